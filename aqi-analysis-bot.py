@@ -1,15 +1,59 @@
-from typing import Dict, Optional, Tuple
-from dataclasses import dataclass
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import string
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Coroutine, Dict, Hashable, List, Optional, Tuple, TypedDict, TypeVar
+from dataclasses import asdict, astuple, dataclass, fields, replace
 from pydantic import BaseModel, Field
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
-from firecrawl import FirecrawlApp
+import httpx
+from openai import AsyncOpenAI
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Seconds between status checks while waiting on a Firecrawl job.
+FIRECRAWL_POLL_INTERVAL = 2
+
+# Seconds to wait for a Firecrawl job before giving up on it.
+FIRECRAWL_JOB_TIMEOUT = 300
+
+# Air quality readings change on the order of tens of minutes, so short-lived reuse is safe.
+AQI_CACHE_TTL = 600
+
+# Recommendations for the same profile and readings are reused for this many seconds.
+RECOMMENDATION_CACHE_TTL = 1800
+
+# Cached recommendations kept in memory at once; the least recently used are evicted first.
+RECOMMENDATION_CACHE_MAX_ENTRIES = 256
+
+# Directory owned by the app where recommendations persist across restarts.
+RECOMMENDATION_CACHE_DIR = os.getenv(
+    "RECOMMENDATION_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "aqi-analysis-bot", "recommendations")
+)
+
+# Seconds between status checks while waiting on an OpenAI batch job.
+BATCH_POLL_INTERVAL = 30
+
+# Firecrawl jobs allowed in flight per API key; more than this trips rate limits.
+FIRECRAWL_MAX_CONCURRENCY = int(os.getenv("FIRECRAWL_MAX_CONCURRENCY", "5"))
+
+# Default number of locations sent to Firecrawl per batch scrape in comparison mode.
+FIRECRAWL_BATCH_SIZE = 10
+
+# Result type of an analysis pipeline run through run_analysis.
+T = TypeVar('T')
 
 # Data Models and Schemas
 
-# Model for air quality API responses.
-class AirQualityResponse(BaseModel):
+# Shape of air quality API responses, used for type hints only.
+class AirQualityResponse(TypedDict):
     success: bool
     data: Dict[str, float]
     status: str
@@ -25,6 +69,42 @@ class AirQualitySchema(BaseModel):
     pm10: float = Field(description="PM10 concentration")
     co: float = Field(description="Carbon Monoxide level")
 
+# Air quality readings passed between the fetcher and the health advisor.
+@dataclass(slots=True, frozen=True)
+class AQIData:
+    aqi: float
+    temperature: float
+    humidity: float
+    wind_speed: float
+    pm25: float
+    pm10: float
+    co: float
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, float]) -> "AQIData":
+        """
+        Build readings from an extraction result, ignoring any extra keys it contains.
+        """
+        return cls(**{field.name: float(data[field.name]) for field in fields(cls)})
+
+# Readings returned when air quality data could not be fetched.
+_AQI_ZERO = AQIData(0, 0, 0, 0, 0, 0, 0)
+
+# Extraction prompt and schema are fixed, so build them once at import time.
+_AIR_QUALITY_JSON_SCHEMA = AirQualitySchema.model_json_schema()
+_EXTRACT_PROMPT = (
+    "Extract the most recent data from the page, including the following details:\n"
+    "- Air Quality Index (AQI)\n"
+    "- Temperature (°C)\n"
+    "- Humidity (%)\n"
+    "- Wind Speed (km/h)\n"
+    "- PM2.5 levels (µg/m³)\n"
+    "- PM10 levels (µg/m³)\n"
+    "- Carbon Monoxide (CO) levels (ppb)\n\n"
+    "Additionally, extract the timestamp indicating when this data was recorded."
+)
+_EXTRACTION_OPTIONS = {'prompt': _EXTRACT_PROMPT, 'schema': _AIR_QUALITY_JSON_SCHEMA}
+
 # User input details for analysis.
 @dataclass
 class UserDetails:
@@ -37,16 +117,36 @@ class UserDetails:
     gender: str
     medical_conditions: Optional[str] = None
 
+# Location comparison handed to the OpenAI Batch API, kept in session state until it finishes.
+class BackgroundJob(TypedDict):
+    batch_id: Optional[str]
+    openai_key: str
+    labels: List[str]
+    reports: List[Optional[str]]
+
 
 # Air Quality Analysis and Recommendation Logic
 
-# Class to fetch air quality data from a web source using FirecrawlApp.
+# Class to fetch air quality data from a web source using the Firecrawl API.
 class AirQualityFetcher:
     def __init__(self, firecrawl_key: str) -> None:
         """
         Initialize with the provided Firecrawl API key.
         """
-        self.firecrawl = FirecrawlApp(api_key=firecrawl_key)
+        self.firecrawl_key = firecrawl_key
+        self.api_url = os.getenv('FIRECRAWL_API_URL', 'https://api.firecrawl.dev')
+        self.headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {firecrawl_key}'}
+        self.set_max_concurrency(FIRECRAWL_MAX_CONCURRENCY)
+
+    def set_max_concurrency(self, max_concurrency: int) -> None:
+        """
+        Limit how many Firecrawl jobs this key runs at once.
+        Jobs already holding a slot finish under the previous limit.
+        """
+        if getattr(self, 'max_concurrency', None) == max_concurrency:
+            return
+        self.max_concurrency = max_concurrency
+        self._sem = asyncio.Semaphore(max_concurrency)
 
     def _format_url(self, country: str, state: str, city: str) -> str:
         """
@@ -60,63 +160,256 @@ class AirQualityFetcher:
         state_clean = state.lower().replace(' ', '-')
         return f"https://www.aqi.in/dashboard/{country_clean}/{state_clean}/{city_clean}"
 
-    def fetch_aqi_data(self, city: str, state: str, country: str) -> Dict[str, float]:
+    async def _request(self, method: str, url: str, payload: Optional[Dict] = None) -> Dict:
         """
-        Fetch air quality data from the constructed URL.
+        Send a request through the shared HTTP/2 client and return the decoded JSON body.
+        Must run on the HTTP loop (see run_on_http_loop).
         """
+        response = await get_http_client().request(method, url, headers=self.headers, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def _wait_for_job(self, status_url: str) -> Dict:
+        """
+        Poll a Firecrawl job until it completes and return its final status payload.
+        Raises TimeoutError if the job is still running after FIRECRAWL_JOB_TIMEOUT seconds.
+        """
+        deadline = time.monotonic() + FIRECRAWL_JOB_TIMEOUT
+        while True:
+            status = await self._request('GET', status_url)
+            if status.get('status') == 'completed':
+                return status
+            if status.get('status') in ('failed', 'cancelled'):
+                raise ValueError(f"Firecrawl job {status['status']}: {status.get('error', 'unknown error')}")
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Firecrawl job did not finish within {FIRECRAWL_JOB_TIMEOUT} seconds")
+            await asyncio.sleep(FIRECRAWL_POLL_INTERVAL)
+
+    async def _extract(self, url: str) -> AirQualityResponse:
+        """
+        Run a Firecrawl extract job for the URL and wait for the result.
+        Mirrors FirecrawlApp.extract, which offers no way to plug in a pooled HTTP client.
+        """
+        # The slot is held until the job finishes, so status polls count against the limit too.
+        async with self._sem:
+            job = await self._request('POST', f"{self.api_url}/v1/extract", {
+                'urls': [f"{url}/*"],
+                **_EXTRACTION_OPTIONS,
+                'allowExternalLinks': False,
+                'origin': 'api-sdk'
+            })
+            if not job.get('success') or not job.get('id'):
+                raise ValueError(f"Failed to start AQI extraction: {job.get('error', 'unknown error')}")
+            return await self._wait_for_job(f"{self.api_url}/v1/extract/{job['id']}")
+
+    def extract_aqi_data(self, url: str) -> AQIData:
+        """
+        Run the Firecrawl extract against the given URL and return the parsed air quality data.
+        Blocks the calling thread; raises if the extraction does not succeed.
+        """
+        response = run_on_http_loop(self._extract(url)).result()
+        if not response.get('success'):
+            raise ValueError(f"Failed to fetch AQI data: {response.get('status', 'unknown')}")
+        # Return the air quality data.
+        return AQIData.from_dict(response['data'])
+
+    async def scrape_aqi_data_batch(self, locations: List[Tuple[str, str, str]]) -> List[Optional[AQIData]]:
+        """
+        Scrape air quality data for several locations with a single Firecrawl batch scrape.
+        Returns one entry per location, or None where no usable data came back.
+        Must run on the HTTP loop (see run_on_http_loop).
+        """
+        urls = [self._format_url(country, state, city) for city, state, country in locations]
+        async with self._sem:
+            job = await self._request('POST', f"{self.api_url}/v1/batch/scrape", {
+                'urls': urls,
+                'formats': ['extract'],
+                'extract': _EXTRACTION_OPTIONS
+            })
+            if not job.get('success') or not job.get('id'):
+                raise ValueError(f"Failed to fetch AQI data: {job.get('error', 'unknown error')}")
+            status = await self._wait_for_job(f"{self.api_url}/v1/batch/scrape/{job['id']}")
+            pages = status.get('data') or []
+            # Large results are paginated.
+            while status.get('next'):
+                status = await self._request('GET', status['next'])
+                if not status.get('data'):
+                    break
+                pages.extend(status['data'])
+        pages_by_url = {page.get('metadata', {}).get('sourceURL', '').rstrip('/'): page for page in pages}
+        results = []
+        for index, url in enumerate(urls):
+            page = pages_by_url.get(url)
+            # Fall back to positional matching when source URLs were rewritten (e.g. redirects).
+            if page is None and len(pages) == len(urls):
+                page = pages[index]
+            try:
+                results.append(AQIData.from_dict(page['extract']))
+            except (KeyError, TypeError, ValueError):
+                results.append(None)
+        return results
+
+    async def fetch_aqi_data(
+        self,
+        city: str,
+        state: str,
+        country: str,
+        prefetched: Optional[Future] = None,
+        notify: Optional[Callable[[str, str], None]] = None
+    ) -> AQIData:
+        """
+        Fetch air quality data for the location, reusing recent results when available.
+        Status messages go to notify as (level, message), or straight to the page without it.
+        A prefetched future for the same location is awaited, however long it takes, and a
+        new request is only issued if the prefetch failed.
+        The blocking cached lookup runs in a worker thread so the event loop stays free.
+        """
+        notify = notify or show_message
+        location = city, state, country = normalize_location(city, state, country)
+        aqi_cache = st.session_state.setdefault("aqi_cache", {})
+        cached = aqi_cache.get(location)
+        if cached and time.time() - cached[0] < AQI_CACHE_TTL:
+            return cached[1]
         try:
             url = self._format_url(country, state, city)
-            st.info(f"Accessing data from: {url}")
-            response = self.firecrawl.extract(
-                urls=[f"{url}/*"],
-                params={
-                    'prompt': (
-                        "Extract the most recent data from the page, including the following details:\n"
-                        "- Air Quality Index (AQI)\n"
-                        "- Temperature (°C)\n"
-                        "- Humidity (%)\n"
-                        "- Wind Speed (km/h)\n"
-                        "- PM2.5 levels (µg/m³)\n"
-                        "- PM10 levels (µg/m³)\n"
-                        "- Carbon Monoxide (CO) levels (ppb)\n\n"
-                        "Additionally, extract the timestamp indicating when this data was recorded."
-                    ),
-                    'schema': AirQualitySchema.model_json_schema()
-                }
-            )
-            air_quality_response = AirQualityResponse(**response)
-            if not air_quality_response.success:
-                raise ValueError(f"Failed to fetch AQI data: {air_quality_response.status}")
-            # Return the parsed air quality data.
-            return air_quality_response.data
+            notify("info", f"Accessing data from: {url}")
+            aqi_values = None
+            if prefetched is not None:
+                try:
+                    # A slow prefetch is still the fastest answer: a second job for the same
+                    # URL would start from scratch, as concurrent cache misses are not merged.
+                    aqi_values = await asyncio.wrap_future(prefetched)
+                except Exception:
+                    # Fall back to a fresh request if the prefetch failed.
+                    aqi_values = None
+            if aqi_values is None:
+                aqi_values = await asyncio.to_thread(fetch_cached_aqi_data, *location, self.firecrawl_key)
+            aqi_data = AQIData(*aqi_values)
+            aqi_cache[location] = (time.time(), aqi_data)
+            return aqi_data
         except Exception as e:
-            st.error(f"Error fetching AQI data: {e}")
+            notify("error", f"Error fetching AQI data: {e}")
             # Return default values if an error occurs.
-            return {
-                'aqi': 0,
-                'temperature': 0,
-                'humidity': 0,
-                'wind_speed': 0,
-                'pm25': 0,
-                'pm10': 0,
-                'co': 0
-            }
+            return _AQI_ZERO
+
+    async def fetch_aqi_data_batch(
+        self,
+        locations: List[Tuple[str, str, str]],
+        batch_size: int = FIRECRAWL_BATCH_SIZE,
+        notify: Optional[Callable[[str, str], None]] = None
+    ) -> List[AQIData]:
+        """
+        Fetch air quality data for several locations, in the same order as given.
+        Locations missing from the session cache are split into batches of batch_size,
+        and the batches are scraped concurrently, at most max_concurrency at a time.
+        Errors go to notify as (level, message), or straight to the page without it.
+        """
+        notify = notify or show_message
+        locations = [normalize_location(*location) for location in locations]
+        aqi_cache = st.session_state.setdefault("aqi_cache", {})
+        now = time.time()
+        results = {
+            location: aqi_cache[location][1]
+            for location in locations
+            if location in aqi_cache and now - aqi_cache[location][0] < AQI_CACHE_TTL
+        }
+        pending = [location for location in dict.fromkeys(locations) if location not in results]
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        responses = await asyncio.gather(
+            *(asyncio.wrap_future(run_on_http_loop(self.scrape_aqi_data_batch(batch))) for batch in batches),
+            return_exceptions=True
+        )
+        for batch, response in zip(batches, responses):
+            if isinstance(response, Exception):
+                notify("error", f"Error fetching AQI data: {response}")
+                continue
+            for location, aqi_data in zip(batch, response):
+                if aqi_data is None:
+                    notify("error", f"Error fetching AQI data: no data returned for {', '.join(filter(None, location))}")
+                    continue
+                aqi_cache[location] = (time.time(), aqi_data)
+                results[location] = aqi_data
+        # Return default values for locations that could not be fetched.
+        return [results.get(location, _AQI_ZERO) for location in locations]
+
+
+def normalize_location(city: str, state: str, country: str) -> Tuple[str, str, str]:
+    """
+    Normalize location fields so equivalent inputs share a cache entry.
+    """
+    return city.strip().lower(), state.strip().lower(), country.strip().lower()
+
+
+def show_message(level: str, message: str) -> None:
+    """
+    Render a status message on the page; level names the Streamlit call, e.g. "info" or "error".
+    Only call this from the script thread.
+    """
+    getattr(st, level)(message)
+
+
+@st.cache_data(ttl=AQI_CACHE_TTL, show_spinner=False)
+def fetch_cached_aqi_data(city: str, state: str, country: str, firecrawl_key: str) -> Tuple[float, ...]:
+    """
+    Fetch air quality data for a normalized location, cached for AQI_CACHE_TTL seconds.
+    Failed extractions raise and are therefore never cached.
+    Returns the AQIData field values as a plain tuple: the cached fetcher may build AQIData
+    from an earlier rerun's __main__ module, which Streamlit cannot pickle.
+    """
+    fetcher = get_fetcher(firecrawl_key)
+    return astuple(fetcher.extract_aqi_data(fetcher._format_url(country, state, city)))
+
+# Disclaimer that ends every recommendation.
+_DISCLAIMER = (
+    "The information is sourced from third-party aggregators and may not reflect the latest conditions. "
+    "It is provided for informational purposes only and should not be solely relied upon for health or safety decisions. "
+    "Please verify with official sources before taking action."
+)
+
+# Reported for compared locations whose air quality data could not be fetched.
+_NO_AQI_DATA_REPORT = "⚠️ Air quality data could not be fetched for this location, so no recommendations were generated."
+
+# Reported for compared locations whose request in a background batch job failed.
+_BATCH_FAILED_REPORT = "⚠️ Recommendations could not be generated for this location. Run the comparison again to retry it."
+
+# Prewritten recommendations keyed by (AQI bucket of 50, has medical conditions).
+# Combinations without an entry are sent to the model.
+_FAST_PATH_TEMPLATES: Dict[Tuple[int, bool], string.Template] = {
+    (0, False): string.Template("""### Air Quality Assessment for $location
+
+The current Air Quality Index is **$aqi**, which is in the *Good* range (0–50). Air pollution poses little or no risk, and no special precautions are needed.
+
+**Current conditions**
+- PM2.5: $pm25 µg/m³
+- PM10: $pm10 µg/m³
+- CO: $co ppb
+- Temperature: $temperature°C, Humidity: $humidity%, Wind Speed: $wind_speed km/h
+
+**Your planned activity**
+
+Air quality is suitable for your planned activity (*$planned_activity*) in the $activity_time. You can proceed as planned.
+- Dress for the temperature and stay hydrated, especially during longer or more strenuous activity.
+- If you notice unusual symptoms such as coughing, wheezing or shortness of breath, slow down and rest.
+
+""" + _DISCLAIMER + "\n")
+}
 
 # Class to generate health recommendations based on air quality data using OpenAI's API.
 class HealthAdvisorAgent:
     def __init__(self, openai_key: str) -> None:
         """
         Initialize with the provided OpenAI API key.
+        Streaming calls share one pooled HTTP client, so they must run on the HTTP loop.
         """
-        self.agent = Agent(
-            model=OpenAIChat(
-                id='gpt-4o',
-                name="Health Advisor Agent",
-                api_key=openai_key
-            )
+        self.model = OpenAIChat(
+            id='gpt-4o',
+            name="Health Advisor Agent",
+            api_key=openai_key,
+            # OpenAIChat otherwise opens a new, never-closed HTTP client for every async call.
+            async_client=AsyncOpenAI(api_key=openai_key, http_client=get_openai_http_client())
         )
 
-    def _create_prompt(self, aqi_data: Dict[str, float], user_details: UserDetails) -> str:
+    def _create_prompt(self, aqi_data: AQIData, user_details: UserDetails) -> str:
         """
         Construct the prompt using air quality data and user details.
         """
@@ -128,15 +421,15 @@ Location:
 - {user_details.city}, {user_details.state}, {user_details.country}
 
 Air Quality Data:
-- Overall AQI: {aqi_data['aqi']}
-- PM2.5: {aqi_data['pm25']} µg/m³
-- PM10: {aqi_data['pm10']} µg/m³
-- CO: {aqi_data['co']} ppb
+- Overall AQI: {aqi_data.aqi}
+- PM2.5: {aqi_data.pm25} µg/m³
+- PM10: {aqi_data.pm10} µg/m³
+- CO: {aqi_data.co} ppb
 
 Weather Conditions:
-- Temperature: {aqi_data['temperature']}°C
-- Humidity: {aqi_data['humidity']}%
-- Wind Speed: {aqi_data['wind_speed']} km/h
+- Temperature: {aqi_data.temperature}°C
+- Humidity: {aqi_data.humidity}%
+- Wind Speed: {aqi_data.wind_speed} km/h
 
 User Profile:
 - Age: {user_details.age or 'N/A'}
@@ -153,39 +446,553 @@ Based on the above, please:
 
 Provide clear, step-by-step explanations and, at the end, include the following disclaimer:
 
-The information is sourced from third-party aggregators and may not reflect the latest conditions. It is provided for informational purposes only and should not be solely relied upon for health or safety decisions. Please verify with official sources before taking action.
+{_DISCLAIMER}
 """
 
-    def get_recommendations(self, aqi_data: Dict[str, float], user_details: UserDetails) -> str:
+    async def stream_recommendations(self, aqi_data: AQIData, user_details: UserDetails) -> AsyncIterator[str]:
         """
-        Generate health recommendations using the constructed prompt.
+        Stream health recommendations for the constructed prompt as they are generated.
+        Must run on the HTTP loop (see run_on_http_loop).
         """
         prompt = self._create_prompt(aqi_data, user_details)
-        response = self.agent.run(prompt)
-        return response.content
+        # Each run gets its own agent so concurrent analyses don't share run state.
+        agent = Agent(model=self.model)
+        async for chunk in await agent.arun(prompt, stream=True):
+            if chunk.content:
+                yield chunk.content
+
+    async def get_recommendations(
+        self,
+        aqi_data: AQIData,
+        user_details: UserDetails,
+        on_chunk: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """
+        Generate health recommendations using the constructed prompt.
+        If provided, on_chunk is called with the text generated so far after every streamed chunk.
+        Must run on the HTTP loop (see run_on_http_loop).
+        """
+        buf = []
+        async for content in self.stream_recommendations(aqi_data, user_details):
+            buf.append(content)
+            if on_chunk:
+                on_chunk("".join(buf))
+        return "".join(buf)
+
+    def submit_recommendations_batch(self, prompts: List[str]) -> str:
+        """
+        Submit prompts as an OpenAI Batch API job and return the batch id.
+        Batch jobs cost less and have separate rate limits, but can take up to 24 hours,
+        so results are picked up later with collect_recommendations_batch.
+        """
+        client = self.model.get_client()
+        lines = [
+            json.dumps({
+                'custom_id': str(index),
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {'model': self.model.id, 'messages': [{'role': 'user', 'content': prompt}]}
+            })
+            for index, prompt in enumerate(prompts)
+        ]
+        input_file = client.files.create(
+            file=("requests.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def collect_recommendations_batch(self, batch_id: str, count: int) -> Optional[List[Optional[str]]]:
+        """
+        Return the responses of a finished batch job in prompt order, or None while it is still running.
+        Prompts without a successful response, including any left over when the job expired or
+        was cancelled, come back as None. Raises only if the job as a whole failed.
+        """
+        client = self.model.get_client()
+        batch = client.batches.retrieve(batch_id)
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            return None
+        if batch.status == "failed":
+            raise ValueError(f"OpenAI batch {batch.id} failed")
 
+        responses: Dict[str, str] = {}
+        # The output file only exists if at least one request succeeded.
+        if batch.output_file_id:
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                if response.get('status_code') == 200:
+                    responses[result['custom_id']] = response['body']['choices'][0]['message']['content']
+        return [responses.get(str(index)) for index in range(count)]
 
-def analyze_conditions(user_details: UserDetails, api_keys: Dict[str, str]) -> str:
+
+async def analyze_conditions(
+    user_details: UserDetails,
+    api_keys: Dict[str, str],
+    on_chunk: Optional[Callable[[str], None]] = None,
+    force_refresh: bool = False,
+    notify: Optional[Callable[[str, str], None]] = None
+) -> str:
     """
     Orchestrates the analysis by fetching air quality data and generating health recommendations.
+    The health advisor is set up while the air quality request is in flight.
+    """
+    air_quality_fetcher = get_fetcher(api_keys['firecrawl'])
+    aqi_data, _ = await asyncio.gather(
+        air_quality_fetcher.fetch_aqi_data(
+            city=user_details.city,
+            state=user_details.state,
+            country=user_details.country,
+            prefetched=take_prefetched_aqi_data(user_details.city, user_details.state, user_details.country),
+            notify=notify
+        ),
+        asyncio.to_thread(get_health_advisor, api_keys['openai'])
+    )
+    return await recommend(aqi_data, user_details, api_keys['openai'], on_chunk=on_chunk, force_refresh=force_refresh)
+
+
+async def fetch_locations(
+    user_details: UserDetails,
+    locations: List[Tuple[str, str, str]],
+    api_keys: Dict[str, str],
+    batch_size: int = FIRECRAWL_BATCH_SIZE,
+    notify: Optional[Callable[[str, str], None]] = None
+) -> Tuple[List[UserDetails], List[AQIData]]:
+    """
+    Fetch air quality data for each distinct location in batches.
+    Returns the user details moved to each location alongside its readings.
+    """
+    # Drop repeated locations, keeping the first spelling entered.
+    unique_locations: Dict[Tuple[str, str, str], Tuple[str, str, str]] = {}
+    for location in locations:
+        unique_locations.setdefault(normalize_location(*location), location)
+    locations = list(unique_locations.values())
+    air_quality_fetcher = get_fetcher(api_keys['firecrawl'])
+    aqi_batch, _ = await asyncio.gather(
+        air_quality_fetcher.fetch_aqi_data_batch(locations, batch_size=batch_size, notify=notify),
+        asyncio.to_thread(get_health_advisor, api_keys['openai'])
+    )
+    location_details = [
+        replace(user_details, city=city, state=state, country=country)
+        for city, state, country in locations
+    ]
+    return location_details, aqi_batch
+
+
+def format_comparison(labels: List[str], reports: List[str]) -> str:
+    """
+    Combine per-location reports into a single report with a heading for each location.
+    """
+    return "\n\n---\n\n".join(f"## 📍 {label}\n\n{report}" for label, report in zip(labels, reports))
+
+
+def location_label(user_details: UserDetails) -> str:
+    """
+    Format the location of the user details for display.
+    """
+    return ', '.join(filter(None, [user_details.city, user_details.state, user_details.country]))
+
+
+async def analyze_locations(
+    user_details: UserDetails,
+    locations: List[Tuple[str, str, str]],
+    api_keys: Dict[str, str],
+    batch_size: int = FIRECRAWL_BATCH_SIZE,
+    force_refresh: bool = False,
+    notify: Optional[Callable[[str, str], None]] = None
+) -> str:
+    """
+    Compare several locations for the same user profile.
+    Air quality data for all locations is fetched in batches, then the recommendations are
+    generated concurrently and combined into a single report.
+    """
+    location_details, aqi_batch = await fetch_locations(user_details, locations, api_keys, batch_size, notify)
+
+    async def report(aqi_data: AQIData, details: UserDetails) -> str:
+        if is_placeholder_aqi(aqi_data):
+            return _NO_AQI_DATA_REPORT
+        return await recommend(aqi_data, details, api_keys['openai'], force_refresh=force_refresh)
+
+    reports = await asyncio.gather(*(
+        report(aqi_data, details) for aqi_data, details in zip(aqi_batch, location_details)
+    ))
+    return format_comparison([location_label(details) for details in location_details], reports)
+
+
+async def submit_background_comparison(
+    user_details: UserDetails,
+    locations: List[Tuple[str, str, str]],
+    api_keys: Dict[str, str],
+    batch_size: int = FIRECRAWL_BATCH_SIZE,
+    notify: Optional[Callable[[str, str], None]] = None
+) -> BackgroundJob:
+    """
+    Start a location comparison whose model calls go through the OpenAI Batch API.
+    Locations on the fast path or without air quality data are reported right away; the
+    rest are picked up by collect_background_comparison once the batch job finishes.
+    """
+    location_details, aqi_batch = await fetch_locations(user_details, locations, api_keys, batch_size, notify)
+    health_advisor = get_health_advisor(api_keys['openai'])
+    reports: List[Optional[str]] = []
+    prompts = []
+    for aqi_data, details in zip(aqi_batch, location_details):
+        report = _NO_AQI_DATA_REPORT if is_placeholder_aqi(aqi_data) else fast_path_recommendations(aqi_data, details)
+        if report is None:
+            prompts.append(health_advisor._create_prompt(aqi_data, details))
+        reports.append(report)
+    batch_id = None
+    if prompts:
+        batch_id = await asyncio.to_thread(health_advisor.submit_recommendations_batch, prompts)
+    return {
+        'batch_id': batch_id,
+        'openai_key': api_keys['openai'],
+        'labels': [location_label(details) for details in location_details],
+        'reports': reports
+    }
+
+
+def collect_background_comparison(job: BackgroundJob) -> Optional[str]:
+    """
+    Return the combined report for a background comparison, or None while its batch job is running.
+    Locations whose batch request failed get an error report; the rest are kept.
+    """
+    responses: Optional[List[Optional[str]]] = []
+    if job['batch_id'] is not None:
+        responses = get_health_advisor(job['openai_key']).collect_recommendations_batch(
+            job['batch_id'], count=job['reports'].count(None)
+        )
+    if responses is None:
+        return None
+    pending = iter(responses)
+    reports = []
+    for report in job['reports']:
+        if report is None:
+            report = next(pending) or _BATCH_FAILED_REPORT
+        reports.append(report)
+    return format_comparison(job['labels'], reports)
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_loop() -> asyncio.AbstractEventLoop:
     """
-    air_quality_fetcher = AirQualityFetcher(firecrawl_key=api_keys['firecrawl'])
-    health_advisor = HealthAdvisorAgent(openai_key=api_keys['openai'])
-    aqi_data = air_quality_fetcher.fetch_aqi_data(
-        city=user_details.city,
-        state=user_details.state,
-        country=user_details.country
+    Start the background event loop that owns the shared Firecrawl and OpenAI HTTP clients.
+    Pooled connections are bound to the loop that opened them, so every Firecrawl and model
+    request is scheduled here rather than on the short-lived per-analysis loops.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="shared-http", daemon=True).start()
+    return loop
+
+
+def open_pooled_client(timeout: httpx.Timeout) -> httpx.AsyncClient:
+    """
+    Open an HTTP/2 client for use on the HTTP loop, closed when the app exits.
+    """
+    client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        timeout=timeout
     )
-    return health_advisor.get_recommendations(aqi_data, user_details)
+    loop = get_http_loop()
+    atexit.register(lambda: asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5))
+    return client
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared HTTP/2 client used for Firecrawl requests.
+    """
+    return open_pooled_client(httpx.Timeout(30.0))
+
+
+@st.cache_resource(show_spinner=False)
+def get_openai_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared HTTP/2 client used for OpenAI requests, whatever the API key.
+    Streamed completions can run for minutes, so only connecting is held to a short timeout.
+    """
+    return open_pooled_client(httpx.Timeout(600.0, connect=5.0))
+
+
+def run_on_http_loop(coro: Coroutine) -> Future:
+    """
+    Schedule a coroutine on the HTTP loop and return a future for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_http_loop())
+
+
+@st.cache_resource(show_spinner=False)
+def get_fetcher(firecrawl_key: str) -> AirQualityFetcher:
+    """
+    Return a shared AirQualityFetcher for the key, reused across reruns and sessions.
+    """
+    return AirQualityFetcher(firecrawl_key=firecrawl_key)
+
+
+@st.cache_resource(show_spinner=False)
+def get_health_advisor(openai_key: str) -> HealthAdvisorAgent:
+    """
+    Return a shared HealthAdvisorAgent for the key, reused across reruns and sessions.
+    """
+    return HealthAdvisorAgent(openai_key=openai_key)
+
+
+@st.cache_resource(show_spinner=False)
+def get_recommendation_cache_state() -> Dict[str, int]:
+    """
+    Return the recommendation cache bookkeeping shared by all sessions.
+    """
+    return {'pruned_window': -1}
+
+
+def prune_recommendation_cache(window: int) -> None:
+    """
+    Delete persisted recommendations from earlier windows, at most once per window.
+    Their keys can never match again, and nothing else removes them.
+    """
+    state = get_recommendation_cache_state()
+    if state['pruned_window'] == window:
+        return
+    state['pruned_window'] = window
+    if not os.path.isdir(RECOMMENDATION_CACHE_DIR):
+        return
+    # Anything written over a full TTL ago belongs to a window that has ended.
+    cutoff = time.time() - RECOMMENDATION_CACHE_TTL
+    for entry in os.scandir(RECOMMENDATION_CACHE_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            # Another session may have removed it first.
+            pass
+
+
+def recommendation_cache_path(aqi_values: Tuple[float, ...], user_fields: Tuple, openai_key: str, window: int) -> str:
+    """
+    Return the file under RECOMMENDATION_CACHE_DIR that persists recommendations for these inputs.
+    """
+    digest = hashlib.sha256(repr((aqi_values, user_fields, openai_key, window)).encode("utf-8")).hexdigest()
+    return os.path.join(RECOMMENDATION_CACHE_DIR, f"{digest}.md")
+
+
+@st.cache_data(ttl=RECOMMENDATION_CACHE_TTL, max_entries=RECOMMENDATION_CACHE_MAX_ENTRIES, show_spinner=False)
+def generate_cached_recommendations(
+    aqi_values: Tuple[float, ...],
+    user_fields: Tuple,
+    openai_key: str,
+    window: int,
+    _on_chunk: Optional[Callable[[str], None]] = None
+) -> str:
+    """
+    Generate recommendations for hashable AQI readings and user details.
+    Results are cached in memory and written to RECOMMENDATION_CACHE_DIR, so they also survive
+    restarts. Entries expire through the window argument, which changes every
+    RECOMMENDATION_CACHE_TTL seconds, and expired files are removed by prune_recommendation_cache.
+    """
+    path = recommendation_cache_path(aqi_values, user_fields, openai_key, window)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        pass
+    health_advisor = get_health_advisor(openai_key)
+    recommendations = run_on_http_loop(
+        health_advisor.get_recommendations(AQIData(*aqi_values), UserDetails(*user_fields), on_chunk=_on_chunk)
+    ).result()
+    try:
+        os.makedirs(RECOMMENDATION_CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial report.
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(recommendations)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Persisting is best effort; the in-memory copy still serves this process.
+        pass
+    return recommendations
+
+
+def is_placeholder_aqi(aqi_data: AQIData) -> bool:
+    """
+    Check whether the readings are the all-zero placeholder returned when a fetch fails.
+    """
+    # Compare by value: cached fetchers may hold readings built by an earlier rerun's class.
+    return astuple(aqi_data) == astuple(_AQI_ZERO)
+
+
+def fast_path_recommendations(aqi_data: AQIData, user_details: UserDetails) -> Optional[str]:
+    """
+    Return prewritten recommendations for benign conditions, or None if the model is needed.
+    Placeholder readings from a failed fetch never qualify.
+    """
+    if is_placeholder_aqi(aqi_data):
+        return None
+    bucket = min(int(aqi_data.aqi) // 50, 5)
+    template = _FAST_PATH_TEMPLATES.get((bucket, bool(user_details.medical_conditions)))
+    if template is None:
+        return None
+    return template.substitute({
+        **asdict(aqi_data),
+        'location': location_label(user_details),
+        'planned_activity': user_details.planned_activity or 'Not specified',
+        'activity_time': (user_details.activity_time or 'day').lower()
+    })
+
+
+async def recommend(
+    aqi_data: AQIData,
+    user_details: UserDetails,
+    openai_key: str,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    force_refresh: bool = False
+) -> str:
+    """
+    Generate recommendations through the persisted cache without blocking the event loop.
+    Benign conditions with a prewritten template skip the model entirely.
+    With force_refresh, any cached copy is dropped and the recommendations are regenerated.
+    """
+    fast_path = fast_path_recommendations(aqi_data, user_details)
+    if fast_path is not None:
+        return fast_path
+    window = int(time.time() // RECOMMENDATION_CACHE_TTL)
+    prune_recommendation_cache(window)
+    args = (astuple(aqi_data), astuple(user_details), openai_key, window)
+    if force_refresh:
+        generate_cached_recommendations.clear(*args)
+        try:
+            os.remove(recommendation_cache_path(*args))
+        except FileNotFoundError:
+            pass
+    return await asyncio.to_thread(generate_cached_recommendations, *args, _on_chunk=on_chunk)
+
+
+def prefetch_aqi_data(city: str, state: str, country: str) -> None:
+    """
+    Start fetching air quality data in the background once the location has settled.
+    The location counts as settled when it is unchanged since the previous rerun.
+    """
+    firecrawl_key = st.session_state.api_keys['firecrawl']
+    if not (city and country and firecrawl_key):
+        return
+    location = normalize_location(city, state, country)
+    previous = st.session_state.get("prefetch_location")
+    st.session_state["prefetch_location"] = location
+    pending = st.session_state.get("aqi_future")
+    if location != previous or (pending and pending[0] == location):
+        return
+    future = get_worker_pool().submit(fetch_cached_aqi_data, *location, firecrawl_key)
+    st.session_state["aqi_future"] = (location, future)
+
+
+def take_prefetched_aqi_data(city: str, state: str, country: str) -> Optional[Future]:
+    """
+    Return and consume the prefetched future for the location, if one is pending.
+    """
+    pending = st.session_state.get("aqi_future")
+    if pending and pending[0] == normalize_location(city, state, country):
+        del st.session_state["aqi_future"]
+        return pending[1]
+    return None
+
+
+def get_worker_pool() -> ThreadPoolExecutor:
+    """
+    Return this session's thread pool for background prefetches and analyses.
+    """
+    if "worker_pool" not in st.session_state:
+        st.session_state["worker_pool"] = ThreadPoolExecutor(max_workers=4)
+    return st.session_state["worker_pool"]
+
+
+def run_analysis(
+    key: Hashable,
+    pipeline: Callable[[Callable[[str], None], Callable[[str, str], None]], Awaitable[T]],
+    on_chunk: Optional[Callable[[str], None]] = None
+) -> T:
+    """
+    Run an analysis pipeline in the worker pool, collapsing identical requests into one.
+    If a pipeline with the same key is still in flight (e.g. after a double-click or a rerun
+    mid-analysis), its result is awaited instead of starting another one. The pipeline is
+    called with on_chunk and notify callbacks that only record progress. Streamed text is
+    passed to on_chunk and status messages are rendered from the script thread, so they land
+    in the current run's page, and every wait tick touches the page so Streamlit can
+    interrupt the wait when the user stops or reruns the app.
+    """
+    inflight = st.session_state.setdefault("inflight", {})
+    if key not in inflight:
+        progress = {'text': '', 'messages': []}
+        ctx = get_script_run_ctx()
+
+        def job() -> T:
+            # Give the worker access to this session's state.
+            add_script_run_ctx(threading.current_thread(), ctx)
+            return asyncio.run(pipeline(
+                lambda text: progress.update(text=text),
+                lambda level, message: progress['messages'].append((level, message))
+            ))
+
+        inflight[key] = (get_worker_pool().submit(job), progress)
+    future, progress = inflight[key]
+    shown = ''
+    shown_messages = 0
+
+    def show_new_messages() -> None:
+        nonlocal shown_messages
+        for level, message in progress['messages'][shown_messages:]:
+            show_message(level, message)
+            shown_messages += 1
+
+    # Stop and rerun requests are only handled when the script thread calls into Streamlit.
+    heartbeat = st.empty()
+    try:
+        while True:
+            show_new_messages()
+            try:
+                return future.result(timeout=0.1)
+            except TimeoutError:
+                if on_chunk and progress['text'] != shown:
+                    shown = progress['text']
+                    on_chunk(shown)
+                else:
+                    heartbeat.empty()
+    finally:
+        # Keep unfinished pipelines registered so the next rerun can pick them up.
+        if future.done():
+            inflight.pop(key, None)
+            show_new_messages()
 
 # Streamlit UI Components
 
+# Static page styles and title, built once at import time.
+_PAGE_CSS = """
+<style>
+.block-container {
+    padding-left: 1rem !important;
+    padding-right: 1rem !important;
+}
+</style>
+"""
+_PAGE_HEADER_HTML = _PAGE_CSS + "<h1 style='font-size: 2.5rem;'>🌍 AQI Analysis Bot</h1>"
+
 def initialize_session_state() -> None:
     """
-    Initialize session state with default API keys if not already present.
+    Initialize session state with default API keys and settings if not already present.
     """
     if 'api_keys' not in st.session_state:
         st.session_state.api_keys = {'firecrawl': '', 'openai': ''}
+    if 'settings' not in st.session_state:
+        st.session_state.settings = {
+            'batch_size': FIRECRAWL_BATCH_SIZE,
+            'max_concurrency': FIRECRAWL_MAX_CONCURRENCY,
+            'background_mode': False
+        }
 
 
 def setup_page() -> None:
@@ -193,18 +1000,9 @@ def setup_page() -> None:
     Configure the Streamlit page layout and header.
     """
     st.set_page_config(page_title="AQI Analysis Bot", page_icon="🌍", layout="wide")
-    st.markdown(
-        """
-        <style>
-        .block-container {
-            padding-left: 1rem !important;
-            padding-right: 1rem !important;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
-    st.markdown("<h1 style='font-size: 2.5rem;'>🌍 AQI Analysis Bot</h1>", unsafe_allow_html=True)
+    # Streamlit drops elements a rerun does not emit, so the styles are sent on every run,
+    # together with the title as a single element.
+    st.markdown(_PAGE_HEADER_HTML, unsafe_allow_html=True)
     st.markdown(
         "Welcome to AQI Analysis Bot — an engaging application that analyzes local air quality alongside your health details to determine if it’s safe to proceed with your intended activity"
     )
@@ -212,7 +1010,7 @@ def setup_page() -> None:
 
 def render_sidebar() -> None:
     """
-    Render the sidebar for API key configuration.
+    Render the sidebar for API key configuration and settings.
     """
     with st.sidebar:
         st.header("🔑 API Configuration")
@@ -239,10 +1037,54 @@ def render_sidebar() -> None:
             })
             st.success("✅ API keys updated!")
 
+        st.header("⚙️ Settings")
+        st.session_state.settings['batch_size'] = st.number_input(
+            "Firecrawl Batch Size",
+            min_value=1,
+            max_value=100,
+            step=1,
+            value=st.session_state.settings['batch_size'],
+            help="Number of locations scraped per Firecrawl batch request when comparing locations."
+        )
+        st.session_state.settings['max_concurrency'] = st.number_input(
+            "Firecrawl Max Concurrency",
+            min_value=1,
+            max_value=50,
+            step=1,
+            value=st.session_state.settings['max_concurrency'],
+            help="Maximum number of Firecrawl jobs in flight at once. Higher values can trip rate limits."
+        )
+        st.session_state.settings['background_mode'] = st.toggle(
+            "Background Mode",
+            value=st.session_state.settings['background_mode'],
+            help="Generate comparison reports through the OpenAI Batch API. Cheaper and not subject to the usual rate limits, but results can take minutes to hours."
+        )
+
 
-def render_main_content() -> UserDetails:
+def parse_locations(text: str, default_country: str) -> List[Tuple[str, str, str]]:
+    """
+    Parse one location per line in the form "City, State, Country" or "City, Country".
+    Lines with only a city use the default country.
+    """
+    locations = []
+    for line in text.splitlines():
+        parts = [part.strip() for part in line.split(',')]
+        if not parts[0]:
+            continue
+        if len(parts) == 1:
+            locations.append((parts[0], '', default_country))
+        elif len(parts) == 2:
+            locations.append((parts[0], '', parts[1]))
+        else:
+            locations.append((parts[0], parts[1], parts[2]))
+    return locations
+
+
+def render_main_content() -> Tuple[UserDetails, List[Tuple[str, str, str]]]:
     """
     Render the main content form for collecting user details.
+    Also returns any additional locations to compare against, which is empty unless
+    comparison mode is enabled.
     """
     st.header("Enter Your Details")
     col1, col2, col3 = st.columns(3)
@@ -253,6 +1095,15 @@ def render_main_content() -> UserDetails:
         city = st.text_input("City", placeholder="e.g., Mumbai")
         state = st.text_input("State", placeholder="e.g., Maharashtra")
         country = st.text_input("Country", value="India", placeholder="e.g., United States")
+        compare = st.checkbox("Compare multiple locations")
+        other_locations = ""
+        if compare:
+            other_locations = st.text_area(
+                "Other Locations",
+                placeholder="One per line, e.g.,\nPune, Maharashtra, India\nDelhi, India"
+            )
+    # Overlap the air quality request with the time spent filling in the rest of the form.
+    prefetch_aqi_data(city, state, country)
     
     # Personal Details (Column 2)
     with col2:
@@ -267,7 +1118,7 @@ def render_main_content() -> UserDetails:
         planned_activity = st.text_area("Planned Activity", placeholder="e.g., Jog for 2 hours")
         activity_time = st.selectbox("Activity Time", options=["Morning", "Afternoon", "Evening", "Night"])
     
-    return UserDetails(
+    user_details = UserDetails(
         city=city,
         state=state,
         country=country,
@@ -277,10 +1128,35 @@ def render_main_content() -> UserDetails:
         age=age,
         gender=gender
     )
+    return user_details, parse_locations(other_locations, default_country=country)
 
 
 # Main Application Flow
 
+@st.fragment(run_every=BATCH_POLL_INTERVAL)
+def render_background_job() -> None:
+    """
+    Check on a background comparison without holding up the rest of the page.
+    The fragment reruns by itself every BATCH_POLL_INTERVAL seconds and reruns the whole
+    app once the report is ready.
+    """
+    job = st.session_state.get("background_job")
+    if job is None:
+        return
+    try:
+        result = collect_background_comparison(job)
+    except Exception as e:
+        del st.session_state["background_job"]
+        st.error(f"❌ Background analysis failed: {e}")
+        return
+    if result is None:
+        st.info("⏳ Background analysis in progress. The report will appear here when the batch job finishes, which can take a while.")
+        return
+    del st.session_state["background_job"]
+    st.session_state["recommendations"] = result
+    st.rerun()
+
+
 def main() -> None:
     """
     Run the main application flow:
@@ -292,9 +1168,13 @@ def main() -> None:
     initialize_session_state()
     setup_page()
     render_sidebar()
-    user_details = render_main_content()
+    user_details, comparison_locations = render_main_content()
 
     st.markdown("<br>", unsafe_allow_html=True)
+    force_refresh = st.checkbox(
+        "Force refresh",
+        help="Regenerate recommendations instead of reusing a recently cached copy."
+    )
 
     # Trigger analysis when the button is clicked.
     if st.button("🔍 Analyze & Get Recommendations"):
@@ -303,18 +1183,68 @@ def main() -> None:
         elif not all(st.session_state.api_keys.values()):
             st.error("Please provide both API keys in the sidebar.")
         else:
+            api_keys = dict(st.session_state.api_keys)
+            batch_size = st.session_state.settings['batch_size']
+            background_mode = st.session_state.settings['background_mode']
+            get_fetcher(api_keys['firecrawl']).set_max_concurrency(st.session_state.settings['max_concurrency'])
+            locations = [(user_details.city, user_details.state, user_details.country), *comparison_locations]
+            # Only identical requests share a pipeline, so changed settings always start a new one.
+            run_settings = (tuple(sorted(api_keys.items())), batch_size, force_refresh)
             try:
-                with st.spinner("🔄 Analyzing conditions..."):
-                    result = analyze_conditions(
-                        user_details=user_details,
-                        api_keys=st.session_state.api_keys
+                if comparison_locations and background_mode:
+                    with st.spinner("🔄 Submitting comparison in background mode..."):
+                        job = run_analysis(
+                            key=(astuple(user_details), tuple(comparison_locations), True, run_settings),
+                            pipeline=lambda on_chunk, notify: submit_background_comparison(
+                                user_details=user_details,
+                                locations=locations,
+                                api_keys=api_keys,
+                                batch_size=batch_size,
+                                notify=notify
+                            )
+                        )
+                    # Results are collected by render_background_job on later reruns.
+                    st.session_state["background_job"] = job
+                    st.session_state.pop("recommendations", None)
+                    result = None
+                elif comparison_locations:
+                    with st.spinner("🔄 Comparing locations..."):
+                        result = run_analysis(
+                            key=(astuple(user_details), tuple(comparison_locations), False, run_settings),
+                            pipeline=lambda on_chunk, notify: analyze_locations(
+                                user_details=user_details,
+                                locations=locations,
+                                api_keys=api_keys,
+                                batch_size=batch_size,
+                                force_refresh=force_refresh,
+                                notify=notify
+                            )
+                        )
+                else:
+                    # Stream recommendations into a placeholder as they are generated.
+                    placeholder = st.empty()
+                    result = run_analysis(
+                        key=(astuple(user_details), (), False, run_settings),
+                        pipeline=lambda on_chunk, notify: analyze_conditions(
+                            user_details=user_details,
+                            api_keys=api_keys,
+                            on_chunk=on_chunk,
+                            force_refresh=force_refresh,
+                            notify=notify
+                        ),
+                        on_chunk=lambda text: placeholder.markdown(f"### 📦 Recommendations\n\n{text}")
                     )
+                    placeholder.empty()
+                if result is not None:
                     # Save recommendations in session state for persistence.
                     st.session_state["recommendations"] = result
-                st.success("✅ Analysis completed!")
+                    st.success("✅ Analysis completed!")
             except Exception as e:
                 st.error(f"❌ Error: {e}")
 
+    if "background_job" in st.session_state:
+        render_background_job()
+
     # Display recommendations and offer a download option if available.
     if "recommendations" in st.session_state and st.session_state["recommendations"]:
         st.markdown("### 📦 Recommendations")